@@ -1,23 +1,55 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
-from datetime import datetime, timedelta
-import re
+import orjson
+from datetime import datetime, timedelta, timezone
 import pydeck as pdk
 import os
+import hashlib
 from supabase import create_client, Client
 
 url = st.secrets.get('url')
 
+# Single marker icon shared by every incident on the map
+ICON_ATLAS = "https://cdn-icons-png.flaticon.com/512/684/684908.png"  # simple marker icon
+ICON_MAPPING = {
+    "marker": {"x": 0, "y": 0, "width": 512, "height": 512, "anchorY": 512}  # full 512px image
+}
+
+# Shared HTTP session so API polls reuse the same connection
+@st.cache_resource
+def get_session():
+    return requests.Session()
+
+@st.cache_data(ttl=60)
+def fetch_active(url, etag=None, last_modified=None):
+    # Conditional GET: returns None for data when the feed has not changed
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = get_session().get(url, headers=headers, timeout=5)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return orjson.loads(response.content)['data'], response.headers.get('ETag'), response.headers.get('Last-Modified')
+
 # API status indicator
 try:
-    response = requests.get(url)
-    response.raise_for_status()
-    data = response.json()['data']
+    data, etag, last_modified = fetch_active(url, st.session_state.get('etag'), st.session_state.get('last_modified'))
+    if data is None:
+        data = st.session_state['data']  # 304 Not Modified, reuse last response
+    else:
+        st.session_state['etag'] = etag
+        st.session_state['last_modified'] = last_modified
+        st.session_state['data'] = data
     st.success('✅ API response received successfully!')
 except Exception as e:
     st.error(f'❌ Error fetching data from API: {e}')
     data = []
+    etag = None
 
 # Convert to DataFrame
 df = pd.DataFrame(data)
@@ -26,62 +58,95 @@ df['y'] = df['y'].astype(float)
 
 st.title("Tallahassee Police Active Incidents")
 
-# Load Supabase credentials from Streamlit secrets
-data_url = st.secrets["supabase_url"]
-data_key = st.secrets["supabase_key"]
-supabase: Client = create_client(data_url, data_key)
-
-# Insert new incidents, skip duplicates
-for incident in data:
-    if 'eventinc' not in incident:
-        continue  # skip incomplete records
-    # Check if incident already exists
-    existing = supabase.table('incidents').select('eventinc').eq('eventinc', incident.get('eventinc')).execute()
-    if existing.data:
-        continue  # skip duplicates
-    try:
-        supabase.table('incidents').insert({
-            'eventinc': incident.get('eventinc'),
-            'eventnum': incident.get('eventnum'),
-            'eventdate': incident.get('eventdate'),
-            'eventid': incident.get('eventid'),
-            'x': float(incident.get('x', 0)),
-            'y': float(incident.get('y', 0)),
-            'eventdesc': incident.get('eventdesc'),
-            'eventheadline': incident.get('eventheadline'),
-            'eventaddress': incident.get('eventaddress'),
-            'ipk': incident.get('ipk'),
-            'fetched_at': datetime.now().isoformat()
-        }).execute()
-    except Exception as e:
-        st.error(f"Supabase insert error: {e}")
-
-# Interactive map with clickable markers for active incidents (replaces old map)
-st.subheader("Active Incidents Map (Interactive)")
-if not df[['y', 'x']].dropna().empty:
-    icon_data = {
-        "url": "https://cdn-icons-png.flaticon.com/512/684/684908.png",  # simple marker icon
-        "width": 128,
-        "height": 128,
-        "anchorY": 128
-    }
-    df['icon_data'] = [icon_data] * len(df)
+# Load Supabase credentials from Streamlit secrets, one client reused across reruns
+@st.cache_resource
+def get_supabase() -> Client:
+    return create_client(st.secrets["supabase_url"], st.secrets["supabase_key"])
+
+supabase = get_supabase()
+
+# Load all historical data for analytics, cached across reruns
+@st.cache_data(ttl=300)
+def load_history():
+    hist_df = pd.DataFrame(supabase.table('incidents').select('eventdate,eventdesc,ipk').execute().data)
+    # Clean and parse eventdate for sorting and analytics (collapse repeated spaces first)
+    hist_df['eventdate_clean'] = pd.to_datetime(
+        hist_df['eventdate'].str.replace(r'\s+', ' ', regex=True).str.strip(),
+        format='%b %d %Y %I:%M%p',
+        errors='coerce'
+    )
+    # Low-cardinality text columns as categories so value_counts works on int codes
+    hist_df['eventdesc'] = hist_df['eventdesc'].astype('category')
+    hist_df['ipk'] = hist_df['ipk'].astype('category')
+    return hist_df.sort_values('eventdate_clean', ascending=False)
+
+# Only the last 24 hours of points are needed for the heatmap, filter them in the database
+@st.cache_data(ttl=60)
+def load_recent(hours=24):
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    return pd.DataFrame(supabase.table('incidents').select('x,y').gte('fetched_at', since).execute().data)
+
+# Insert new incidents, let the database skip duplicates on eventinc
+def ingest_incidents(data, df):
+    now_iso = datetime.now(timezone.utc).isoformat()
+    # Reuse the already typed x/y columns instead of calling float() per row; other fields
+    # come straight from the raw payload so integers are not widened to floats by pandas
+    coords = df[['x', 'y']].fillna(0)  # missing coordinates stored as 0, as before
+    rows = [{
+        'eventinc': incident.get('eventinc'),
+        'eventnum': incident.get('eventnum'),
+        'eventdate': incident.get('eventdate'),
+        'eventid': incident.get('eventid'),
+        'x': x,
+        'y': y,
+        'eventdesc': incident.get('eventdesc'),
+        'eventheadline': incident.get('eventheadline'),
+        'eventaddress': incident.get('eventaddress'),
+        'ipk': incident.get('ipk'),
+        'fetched_at': now_iso
+    } for incident, (x, y) in zip(data, coords.itertuples(index=False, name=None))
+        if 'eventinc' in incident]  # skip incomplete records
+    if rows:
+        try:
+            supabase.table('incidents').upsert(rows, on_conflict='eventinc', ignore_duplicates=True).execute()
+            # Show the new incidents in the analytics on this run instead of after the cache TTL
+            load_history.clear()
+            load_recent.clear()
+        except Exception as e:
+            st.error(f"Supabase insert error: {e}")
+
+# Only write to the database when this session sees a payload it has not ingested yet
+# (other sessions may upsert the same payload once; ignore_duplicates makes that a no-op).
+# The ETag identifies the payload when the server sends one, otherwise hash the data.
+fingerprint = (etag or hashlib.sha1(orjson.dumps(data)).hexdigest()) if data else None
+if fingerprint and st.session_state.get('ingested') != fingerprint:
+    ingest_incidents(data, df)
+    st.session_state['ingested'] = fingerprint
+
+# Reuse the same deck for unchanged data instead of rebuilding it every rerun;
+# bounded so decks for old feed snapshots are evicted
+DATAFRAME_HASH = {pd.DataFrame: lambda d: pd.util.hash_pandas_object(d, index=False).sum()}
+
+@st.cache_resource(hash_funcs=DATAFRAME_HASH, max_entries=4, ttl=600)
+def build_icon_deck(df_slim):
     icon_layer = pdk.Layer(
         type="IconLayer",
-        data=df,
-        get_icon="icon_data",
+        data=df_slim,
+        icon_atlas=ICON_ATLAS,
+        icon_mapping=ICON_MAPPING,
+        get_icon="'marker'",  # same icon for every row, no per-row icon column
         get_position='[x, y]',
         get_size=4,
         size_scale=10,
         pickable=True
     )
     view_state = pdk.ViewState(
-        latitude=df['y'].mean(),
-        longitude=df['x'].mean(),
+        latitude=df_slim['y'].mean(),
+        longitude=df_slim['x'].mean(),
         zoom=11,
         pitch=0
     )
-    r = pdk.Deck(
+    return pdk.Deck(
         layers=[icon_layer],
         initial_view_state=view_state,
         tooltip={
@@ -89,113 +154,110 @@ if not df[['y', 'x']].dropna().empty:
             "style": {"color": "white"}
         }
     )
-    st.pydeck_chart(r)
-else:
-    st.info("No active incidents to display on the map.")
-
-# Table of incidents
-st.subheader("Incident Table")
-st.dataframe(df[['eventdate', 'eventdesc', 'eventaddress']])
-
-# Load all historical data for analytics
-hist_df = pd.DataFrame(supabase.table('incidents').select('*').execute().data)
-
-# Convert eventdate to datetime for sorting and analytics
-def clean_eventdate(date_str):
-    if pd.isna(date_str):
-        return None
-    # Replace multiple spaces with a single space
-    date_str = re.sub(r'\s+', ' ', date_str.strip())
-    # Try parsing with known format
-    try:
-        return pd.to_datetime(date_str, format='%b %d %Y %I:%M%p')
-    except Exception:
-        return pd.NaT
-
-# Clean and parse eventdate for sorting and analytics
-hist_df['eventdate_clean'] = hist_df['eventdate'].apply(clean_eventdate)
-hist_df = hist_df.sort_values('eventdate_clean', ascending=False)
-
-# Simple analytics: Most common event types
-st.subheader("Most Common Event Types (All Time)")
-event_counts = hist_df['eventdesc'].value_counts().reset_index()
-event_counts.columns = ['Event Type', 'Count']
-st.bar_chart(event_counts.set_index('Event Type'))
-st.dataframe(event_counts)
-
-# Heatmap for areas with highest crime rate (last 24 hours)
-st.subheader("Crime Concentration Heatmap (Last 24 Hours)")
-
-if 'eventdate_clean' in hist_df:
-    last_24h = datetime.now() - timedelta(hours=24)
-    recent_df = hist_df[hist_df['eventdate_clean'] >= last_24h]
-    if not recent_df[['y', 'x']].dropna().empty:
-        heatmap_layer = pdk.Layer(
-            "HeatmapLayer",
-            data=recent_df,
-            get_position='[x, y]',
-            aggregation=pdk.types.String("MEAN"),
-            get_weight=1,
-            radiusPixels=60,
-        )
-        view_state = pdk.ViewState(
-            latitude=recent_df['y'].mean(),
-            longitude=recent_df['x'].mean(),
-            zoom=11,
-            pitch=50
-        )
-        st.pydeck_chart(pdk.Deck(layers=[heatmap_layer], initial_view_state=view_state))
-        
-        # Show table of events used in the heatmap
-        #st.subheader("Events in Last 24 Hours (Heatmap Data)")
-        #st.dataframe(recent_df[['eventdate', 'eventdesc', 'eventaddress', 'x', 'y']].sort_values('eventdate', ascending=False))
-        
+
+# Pre-bin heatmap points so the payload is bounded by the grid size, not the row count.
+# The grid covers a fixed box around Tallahassee / Leon County (lon, lat); points outside it,
+# e.g. rows stored with placeholder (0, 0) coordinates, are dropped by histogram2d.
+TALLAHASSEE_BOUNDS = [[-84.75, -84.05], [30.25, 30.70]]
+
+def bin_points(points_df, bins=200):
+    counts, x_edges, y_edges = np.histogram2d(points_df['x'], points_df['y'], bins=bins, range=TALLAHASSEE_BOUNDS)
+    x_idx, y_idx = np.nonzero(counts)
+    return pd.DataFrame({
+        'x': (x_edges[x_idx] + x_edges[x_idx + 1]) / 2,
+        'y': (y_edges[y_idx] + y_edges[y_idx + 1]) / 2,
+        'weight': counts[x_idx, y_idx]
+    })
+
+@st.cache_resource(hash_funcs=DATAFRAME_HASH, max_entries=4, ttl=600)
+def build_heatmap_deck(points_df):
+    heatmap_layer = pdk.Layer(
+        "HeatmapLayer",
+        data=points_df,
+        get_position='[x, y]',
+        aggregation=pdk.types.String("SUM"),  # cell counts add back up to per-point density
+        get_weight='weight',
+        radiusPixels=60,
+    )
+    # Centre on the incidents themselves, so weight each cell by its count
+    view_state = pdk.ViewState(
+        latitude=np.average(points_df['y'], weights=points_df['weight']),
+        longitude=np.average(points_df['x'], weights=points_df['weight']),
+        zoom=11,
+        pitch=50
+    )
+    return pdk.Deck(layers=[heatmap_layer], initial_view_state=view_state)
+
+# Dashboard section reruns on its own for widget interactions, without re-running ingestion
+@st.fragment
+def render_dashboard(df, hist_df):
+    # Interactive map with clickable markers for active incidents (replaces old map)
+    st.subheader("Active Incidents Map (Interactive)")
+    if not df[['y', 'x']].dropna().empty:
+        st.pydeck_chart(build_icon_deck(df[['x', 'y', 'eventdesc', 'eventdate', 'eventaddress']]))
+    else:
+        st.info("No active incidents to display on the map.")
+
+    # Table of incidents
+    st.subheader("Incident Table")
+    st.dataframe(df[['eventdate', 'eventdesc', 'eventaddress']])
+
+    # Simple analytics: Most common event types
+    st.subheader("Most Common Event Types (All Time)")
+    event_counts = hist_df['eventdesc'].value_counts()
+    st.bar_chart(event_counts)
+    st.dataframe(event_counts.rename_axis('Event Type').reset_index(name='Count'))
+
+    # Heatmap for areas with highest crime rate (last 24 hours)
+    st.subheader("Crime Concentration Heatmap (Last 24 Hours)")
+
+    recent_df = load_recent()
+    grid_df = bin_points(recent_df[['x', 'y']].dropna()) if not recent_df.empty else pd.DataFrame()
+    if not grid_df.empty:
+        st.pydeck_chart(build_heatmap_deck(grid_df))
     else:
         st.info("Not enough data for heatmap in the last 24 hours.")
-else:
-    st.info("No valid event date data for heatmap.")
-
-# Analytics: Most dangerous times of day
-st.subheader("Times of day with highest incident count (All Time)")
-if 'eventdate_clean' in hist_df:
-    hist_df['hour'] = hist_df['eventdate_clean'].dt.hour
-    hour_counts = hist_df['hour'].value_counts().sort_index()
-    st.bar_chart(hour_counts)
-    hour_counts_df = hour_counts.reset_index()
-    hour_counts_df.columns = ['Hour of day', 'Incident count']
-    st.dataframe(hour_counts_df)
-else:
-    st.info("No valid event date data for time-of-day analysis.")
-
-
-# Pie chart of incidents by ipk (severity/priority)
-st.subheader("Incident Distribution by Severity (ipk)")
-# Blurb explaining ipk
-st.markdown("""
-**What is 'ipk'?**  
-The `ipk` field represents the priority or severity of each incident, as assigned by the Tallahassee Police Department. Lower values (e.g., 1 or 2) typically indicate higher priority or more urgent incidents, while higher values (e.g., 3 or 4) indicate lower priority. This helps identify which incidents require the most immediate attention.
-""")
 
-ipk_label_map = {
-    '1': '1 (Least severe)',
-    '2': '2 (Less severe)',
-    '3': '3 (More severe)',
-    '4': '4 (Most severe)'
-}
-ipk_counts = hist_df['ipk'].value_counts().sort_index()
-labels = [ipk_label_map.get(str(ipk), str(ipk)) for ipk in ipk_counts.index]
-st.plotly_chart({
-    "data": [{
-        "values": ipk_counts.values,
-        "labels": labels,
-        "type": "pie",
-        "hole": .3
-    }],
-    "layout": {"title": "Incidents by Severity (ipk)"}
-})
-# st.dataframe(ipk_counts.reset_index().rename(columns={'index': 'ipk', 'ipk': 'Incident Count'}))
-
-# You can add more analytics below, e.g., by time, by area, etc.
+    # Analytics: Most dangerous times of day
+    st.subheader("Times of day with highest incident count (All Time)")
+    if 'eventdate_clean' in hist_df:
+        hour_counts = hist_df['eventdate_clean'].dt.hour.value_counts().sort_index()
+        st.bar_chart(hour_counts)
+        st.dataframe(hour_counts.rename_axis('Hour of day').reset_index(name='Incident count'))
+    else:
+        st.info("No valid event date data for time-of-day analysis.")
+
+
+    # Pie chart of incidents by ipk (severity/priority)
+    st.subheader("Incident Distribution by Severity (ipk)")
+    # Blurb explaining ipk
+    st.markdown("""
+    **What is 'ipk'?**  
+    The `ipk` field represents the priority or severity of each incident, as assigned by the Tallahassee Police Department. Lower values (e.g., 1 or 2) typically indicate higher priority or more urgent incidents, while higher values (e.g., 3 or 4) indicate lower priority. This helps identify which incidents require the most immediate attention.
+    """)
+
+    ipk_label_map = {
+        '1': '1 (Least severe)',
+        '2': '2 (Less severe)',
+        '3': '3 (More severe)',
+        '4': '4 (Most severe)'
+    }
+    ipk_counts = hist_df['ipk'].value_counts().sort_index()
+    labels = [ipk_label_map.get(str(ipk), str(ipk)) for ipk in ipk_counts.index]
+    st.plotly_chart({
+        "data": [{
+            "values": ipk_counts.values,
+            "labels": labels,
+            "type": "pie",
+            "hole": .3
+        }],
+        "layout": {"title": "Incidents by Severity (ipk)"}
+    })
+    # st.dataframe(ipk_counts.reset_index().rename(columns={'index': 'ipk', 'ipk': 'Incident Count'}))
+
+    # You can add more analytics below, e.g., by time, by area, etc.
+
+render_dashboard(df, load_history())
 
 # Data source attribution
 st.markdown("""